@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+GFS cycle resolution and fetch planning.
+
+Pure functions that decide which GFS run and forecast hour serve a requested
+datetime, and that turn a batch of (datetime, level) requests into a
+deduplicated, ordered list of (cycle, fxx, level) fetches. Nothing here does
+I/O, so the server, the animation stream and the batch tools share one copy
+of the rules and repeated lookups come from a memo.
+
+Run `python gfs_planner.py --bench 100000` to time planning on a large batch.
+"""
+
+import argparse
+import datetime
+import random
+import time
+from collections import namedtuple
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+UTC = ZoneInfo('UTC')
+
+# GFS runs every 6 hours: 00, 06, 12, 18 UTC
+GFS_INIT_HOURS = (0, 6, 12, 18)
+# GFS data typically becomes available 3-4 hours after initialization time
+PROCESSING_DELAY_HOURS = 4
+# Use max 5-day forecast for better data availability
+MAX_FORECAST_HOUR = 120
+
+# fetches: sorted unique (init_date, fxx, level) with naive UTC init dates, as Herbie expects
+# assignments: index into fetches for each request, or None when its datetime or level could not be parsed
+FetchPlan = namedtuple("FetchPlan", ["fetches", "assignments"])
+
+
+@lru_cache(maxsize=65536)
+def _parse_iso(date_str):
+    if date_str.endswith('Z'):
+        date_str = date_str[:-1] + '+00:00'
+    return parse_datetime(datetime.datetime.fromisoformat(date_str))
+
+
+def parse_datetime(date):
+    """Parse an ISO string (a trailing Z is allowed) or datetime as an aware UTC datetime"""
+    if isinstance(date, str):
+        return _parse_iso(date)
+    if date.tzinfo is None:
+        return date.replace(tzinfo=UTC)
+    return date.astimezone(UTC)
+
+
+def planning_now():
+    """Current UTC time truncated to the minute, so resolve_cycle memo entries get reused"""
+    return datetime.datetime.now(UTC).replace(second=0, microsecond=0)
+
+
+@lru_cache(maxsize=65536)
+def resolve_cycle(target_utc, now_utc):
+    """
+    Map an aware UTC target datetime to (target_utc, init_utc, fxx).
+
+    Targets in the future, or too recent for GFS processing to have
+    finished, are pulled back to the latest available time before choosing
+    the most recent run at or before the target.
+    """
+    # Check if target date is in the future - adjust to latest available data
+    if target_utc > now_utc:
+        target_utc = now_utc
+
+    # If target date is too recent, adjust it
+    latest_available_time = now_utc - datetime.timedelta(hours=PROCESSING_DELAY_HOURS)
+    if target_utc > latest_available_time:
+        target_utc = latest_available_time
+
+    # Find the most recent GFS initialization time before or at the target time
+    target_hour = target_utc.hour
+    init_hour = max(h for h in GFS_INIT_HOURS if h <= target_hour)
+    init_utc = target_utc.replace(hour=init_hour, minute=0, second=0, microsecond=0)
+    fxx = target_hour - init_hour
+
+    # Ensure the initialization time is not in the future considering processing delay
+    if init_utc + datetime.timedelta(hours=PROCESSING_DELAY_HOURS) > now_utc:
+        if init_hour > 0:
+            prev_init_hour = max(h for h in GFS_INIT_HOURS if h < init_hour)
+            init_utc = target_utc.replace(hour=prev_init_hour, minute=0, second=0, microsecond=0)
+            fxx = target_hour - prev_init_hour
+        else:
+            # Fall back to yesterday's 18Z run
+            init_utc = (target_utc - datetime.timedelta(days=1)).replace(hour=18, minute=0, second=0, microsecond=0)
+            fxx = target_hour + 6
+
+    # Adjust to use a more recent initialization with shorter forecast
+    while fxx > MAX_FORECAST_HOUR and init_utc > target_utc - datetime.timedelta(days=3):
+        init_utc -= datetime.timedelta(hours=6)
+        fxx += 6
+
+    return target_utc, init_utc, fxx
+
+
+def plan_fetches(requests, now_utc=None):
+    """
+    Turn (datetime, level) requests into a deduplicated FetchPlan.
+
+    Fetches are sorted by cycle, then forecast hour, then level, so every
+    level read from one GRIB file (and its Herbie inventory) is adjacent.
+    """
+    now_utc = now_utc or planning_now()
+    fetch_index = {}
+    keys = []
+    for date, level in requests:
+        try:
+            _, init_utc, fxx = resolve_cycle(parse_datetime(date), now_utc)
+            key = (init_utc.replace(tzinfo=None), fxx, int(level))
+        except (TypeError, ValueError, AttributeError):
+            keys.append(None)
+            continue
+        fetch_index.setdefault(key, None)
+        keys.append(key)
+
+    fetches = sorted(fetch_index)
+    for i, key in enumerate(fetches):
+        fetch_index[key] = i
+    assignments = [fetch_index[key] if key is not None else None for key in keys]
+    return FetchPlan(fetches, assignments)
+
+
+def _benchmark(size, seed=0):
+    """Time plan_fetches on a synthetic batch shaped like checklist traffic"""
+    rng = random.Random(seed)
+    now_utc = planning_now()
+    # Checklists cluster on a few hundred distinct times, each asked for at several levels
+    times = [(now_utc - datetime.timedelta(minutes=rng.randrange(0, 365 * 24 * 60))).isoformat()
+             for _ in range(max(1, size // 20))]
+    levels = (925, 900, 850, 800, 750, 700)
+    requests = [(rng.choice(times), rng.choice(levels)) for _ in range(size)]
+
+    resolve_cycle.cache_clear()
+    _parse_iso.cache_clear()
+    started = time.perf_counter()
+    plan = plan_fetches(requests, now_utc)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    plan_fetches(requests, now_utc)
+    warm = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for date, level in requests:
+        resolve_cycle.__wrapped__(_parse_iso.__wrapped__(date), now_utc)
+    unmemoized = time.perf_counter() - started
+
+    print(f"Requests:          {size}")
+    print(f"Unique fetches:    {len(plan.fetches)}")
+    print(f"Plan (cold memo):  {cold * 1000:.1f} ms ({size / cold:,.0f} req/s)")
+    print(f"Plan (warm memo):  {warm * 1000:.1f} ms ({size / warm:,.0f} req/s)")
+    print(f"Resolve, no memo:  {unmemoized * 1000:.1f} ms ({size / unmemoized:,.0f} req/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GFS fetch planner")
+    parser.add_argument("--bench", type=int, default=100000, help="Number of synthetic requests to plan")
+    args = parser.parse_args()
+    _benchmark(args.bench)
@@ -4,331 +4,385 @@ import datetime
 from flask import jsonify
 import json
 import os
+import sys
+import time
+import argparse
+import base64
+import mmap
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from zoneinfo import ZoneInfo  # Python 3.9+
 # If you're on older Python, use: from datetime import timezone
+import numpy as np
+import gfs_planner
+from shared_cache import SharedCache
 
-def fetch_gfs_data(lat, lon, date, fxx, level=850):
+# Where converted velocity JSON files are cached (override with HERBIE_DATA_DIR)
+DATA_DIR = os.getenv('HERBIE_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+# Cached files for recent cycles younger than this are served without refetching
+CACHE_MAX_AGE_SECONDS = 6 * 3600
+# Cycles initialized longer ago than this are complete upstream, so their cache entries never expire
+RECENT_CYCLE_HOURS = gfs_planner.PROCESSING_DELAY_HOURS + 6
+
+# Index, locks and grid files shared by every server worker using DATA_DIR
+SHARED_CACHE = SharedCache(DATA_DIR)
+# Size budget for DATA_DIR cache files; oldest entries are pruned past it (0 = unlimited)
+CACHE_MAX_BYTES = int(os.getenv('HERBIE_CACHE_MAX_BYTES', '0'))
+
+# Quantization step (m/s) for animation delta frames
+ANIMATION_SCALE = 0.01
+# Frames an animation stream prepares concurrently
+ANIMATION_WORKERS = int(os.getenv('ANIMATION_WORKERS', '4'))
+
+# Pressure levels offered by the client, ordered from the surface upward
+MIGRATION_LEVELS = [925, 900, 850, 800, 750, 700]
+# Derived layers served by /api/weather?product=...
+WIND_PRODUCTS = ("speed", "direction", "shear", "tailwind")
+
+# Optional local mirror of GFS GRIB2 files plus .idx sidecars, read instead of remote archives
+LOCAL_GRIB_DIR = os.getenv('HERBIE_LOCAL_GRIB_DIR')
+# With HERBIE_OFFLINE set, a missing local file is an error rather than a fallback to Herbie
+OFFLINE = os.getenv('HERBIE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# Per-thread record of how the last process_wind_data call was served
+_request_state = threading.local()
+
+def cache_max_age(init_date):
+    """Max cache age in seconds for a cycle (naive UTC init), or None when it never expires"""
+    now_naive = datetime.datetime.now(ZoneInfo('UTC')).replace(tzinfo=None)
+    if init_date <= now_naive - datetime.timedelta(hours=RECENT_CYCLE_HOURS):
+        return None
+    return CACHE_MAX_AGE_SECONDS
+
+def enforce_cache_limit():
+    """Prune the shared cache back under CACHE_MAX_BYTES, if a budget is set"""
+    if CACHE_MAX_BYTES > 0:
+        removed = SHARED_CACHE.prune(CACHE_MAX_BYTES)
+        if removed:
+            print(f"Pruned {removed} old cache entries to stay under {CACHE_MAX_BYTES} bytes")
+
+def reset_cache_outcome():
+    """Clear the cache outcome recorded for the current thread"""
+    _request_state.cache_outcome = None
+
+def get_last_cache_outcome():
+    """Return 'hit', 'stale', 'miss' or 'error' for the last call on this thread"""
+    return getattr(_request_state, 'cache_outcome', None)
+
+def find_local_grib(date, fxx):
+    """Locate a mirrored GFS GRIB2 file and its .idx sidecar under LOCAL_GRIB_DIR"""
+    ymd = date.strftime("%Y%m%d")
+    hh = date.strftime("%H")
+    grib_name = f"gfs.t{hh}z.pgrb2.0p25.f{fxx:03d}"
+    candidates = [
+        os.path.join(LOCAL_GRIB_DIR, "gfs", ymd, grib_name),                # Herbie save_dir layout
+        os.path.join(LOCAL_GRIB_DIR, f"gfs.{ymd}", hh, "atmos", grib_name),  # NOMADS layout
+    ]
+    for path in candidates:
+        if os.path.exists(path) and os.path.exists(path + ".idx"):
+            return path
+    return None
+
+def read_idx_ranges(idx_path, file_size, levels):
+    """Return (start, end) byte ranges of the UGRD/VGRD messages for the given pressure levels"""
+    entries = []
+    with open(idx_path, "r") as f:
+        for line in f:
+            parts = line.strip().split(":")
+            if len(parts) >= 5:
+                entries.append((int(parts[1]), parts[3], parts[4]))
+
+    level_names = {f"{level} mb" for level in levels}
+    ranges = []
+    for i, (offset, variable, level_name) in enumerate(entries):
+        if variable in ("UGRD", "VGRD") and level_name in level_names:
+            end = entries[i + 1][0] if i + 1 < len(entries) else file_size
+            ranges.append((offset, end))
+    return ranges
+
+def fetch_local_gfs_data(date, fxx, levels=(850,)):
+    """Decode only the UGRD/VGRD messages for the given levels from the local GRIB mirror"""
+    path = find_local_grib(date, fxx)
+    if path is None:
+        print(f"No local GRIB file for date={date}, fxx={fxx} under {LOCAL_GRIB_DIR}")
+        return None
+
+    file_size = os.path.getsize(path)
+    ranges = read_idx_ranges(path + ".idx", file_size, levels)
+    if len(ranges) < 2:
+        print(f"Local GRIB index {path}.idx has no UGRD/VGRD messages at {levels} mb")
+        return None
+
+    print(f"Reading {len(ranges)} GRIB messages from local file: {path}")
+    fd, subset_path = tempfile.mkstemp(suffix=".grib2")
     try:
-        print(f"Calling Herbie with: date={date}, fxx={fxx}, level={level}")
-        forecast = herbie.Herbie(date, model="gfs", fxx=fxx)
-        data = forecast.xarray(f"(UGRD|VGRD):{level} mb")
-        data = data.assign_coords(longitude=(((data.longitude + 180) % 360) - 180))
-        data = data.roll(longitude=int(len(data['longitude']) / 2), roll_coords=True)
-        print(f"Successfully fetched GFS data: {data.dims}")
-        return data
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as grib:
+                for start, end in ranges:
+                    dst.write(grib[start:end])
+        with xr.open_dataset(subset_path, engine="cfgrib", backend_kwargs={"indexpath": ""}) as ds:
+            return ds.load()
+    finally:
+        os.remove(subset_path)
+
+def split_levels(data, levels):
+    """Split a fetched u/v dataset (or list of them) into {level: single-level dataset}"""
+    datasets = {}
+    for ds in data if isinstance(data, list) else [data]:
+        if "isobaricInhPa" in ds.dims:
+            for level in ds.isobaricInhPa.values:
+                datasets[int(level)] = ds.sel(isobaricInhPa=level)
+        elif "isobaricInhPa" in ds.coords:
+            datasets[int(ds.isobaricInhPa.values)] = ds
+        elif len(levels) == 1:
+            datasets[levels[0]] = ds
+    return datasets
+
+def fetch_gfs_levels(date, fxx, levels):
+    """Fetch u/v for several pressure levels of one GFS file in a single read, as {level: dataset}"""
+    levels = list(levels)
+    try:
+        data = None
+        if LOCAL_GRIB_DIR:
+            try:
+                data = fetch_local_gfs_data(date, fxx, levels)
+            except Exception as e:
+                # A truncated or undecodable mirror file is treated like a missing one
+                print(f"Error reading local GRIB data for date={date}, fxx={fxx}, levels={levels}: {e}")
+                data = None
+        if data is None:
+            if OFFLINE:
+                print(f"Offline mode: no local GRIB data for date={date}, fxx={fxx}, levels={levels}")
+                return None
+            print(f"Calling Herbie with: date={date}, fxx={fxx}, levels={levels}")
+            forecast = herbie.Herbie(date, model="gfs", fxx=fxx)
+            # One search for every level, so the inventory and GRIB byte ranges are read once
+            data = forecast.xarray(f"(UGRD|VGRD):({'|'.join(str(level) for level in levels)}) mb")
+        # Longitudes stay 0..360 here; grid_from_dataset reorders them once when the grid is cached
+        datasets = split_levels(data, levels)
+        print(f"Successfully fetched GFS data for levels {sorted(datasets)}")
+        return datasets
     except Exception as e:
         print(f"Error fetching GFS data: {e}")
         import traceback
         traceback.print_exc()
         return None
 
-def process_wind_data(lat, lon, date, level=850):
-    print(f"Processing wind data request: lat={lat}, lon={lon}, date={date}, level={level}")
-    
+def fetch_gfs_data(lat, lon, date, fxx, level=850):
+    datasets = fetch_gfs_levels(date, fxx, [level])
+    if not datasets or level not in datasets:
+        return None
+    return datasets[level]
+
+def parse_target_date(date):
+    """Parse an ISO datetime string (or pass through a datetime) as a timezone-aware UTC datetime"""
     try:
-        # Parse the input datetime string and handle different formats
-        if isinstance(date, str):
-            # Handle ISO format with Z suffix or +00:00
-            if date.endswith('Z'):
-                date_str = date[:-1] + '+00:00'
-            else:
-                date_str = date
-            
-            # Parse as timezone-aware datetime
-            target_date_utc = datetime.datetime.fromisoformat(date_str)
-            print(f"Parsed target date (UTC): {target_date_utc}")
-            
-            # If it's not timezone-aware, assume it's UTC
-            if target_date_utc.tzinfo is None:
-                target_date_utc = target_date_utc.replace(tzinfo=ZoneInfo('UTC'))
-        else:
-            target_date_utc = date
-            
+        target_date_utc = gfs_planner.parse_datetime(date)
+        print(f"Parsed target date (UTC): {target_date_utc}")
+        return target_date_utc
     except Exception as e:
         print(f"Error parsing date '{date}': {e}")
         return None
+
+def resolve_gfs_run(date):
+    """Map a requested datetime to (target_date_utc, init_date_utc, fxx) of an available GFS run"""
+    target_date_utc = parse_target_date(date)
+    if target_date_utc is None:
+        return None
     
-    # Convert to UTC if it's not already
-    if target_date_utc.tzinfo != ZoneInfo('UTC'):
-        target_date_utc = target_date_utc.astimezone(ZoneInfo('UTC'))
-        print(f"Converted to UTC: {target_date_utc}")
-    
-    # Check if target date is in the future - adjust to latest available data
-    now_utc = datetime.datetime.now(ZoneInfo('UTC'))
-    if target_date_utc > now_utc:
-        print(f"Target date {target_date_utc} is in the future, using current time: {now_utc}")
-        target_date_utc = now_utc
-    
-    # Find the appropriate GFS initialization time and forecast hour
-    # GFS runs every 6 hours: 00, 06, 12, 18 UTC
-    gfs_init_hours = [0, 6, 12, 18]
-    
-    # For future dates or very recent dates, we need to account for GFS processing delay
-    # GFS data typically becomes available 3-4 hours after initialization time
-    processing_delay_hours = 4
-    latest_available_time = now_utc - datetime.timedelta(hours=processing_delay_hours)
-    
-    # If target date is too recent, adjust it
-    if target_date_utc > latest_available_time:
-        print(f"Target date {target_date_utc} may not have GFS data yet, using {latest_available_time}")
-        target_date_utc = latest_available_time
-    
-    # Find the most recent GFS initialization time before or at the target time
-    target_hour = target_date_utc.hour
-    
-    # Find the closest GFS init time (floor) for the target date
-    suitable_init_hours = [h for h in gfs_init_hours if h <= target_hour]
-    
-    if suitable_init_hours:
-        init_hour = max(suitable_init_hours)
-        init_date_utc = target_date_utc.replace(hour=init_hour, minute=0, second=0, microsecond=0)
-        fxx = target_hour - init_hour
-    else:
-        # If no suitable init hour found for today, use the last run from yesterday
-        init_date_utc = (target_date_utc - datetime.timedelta(days=1)).replace(hour=18, minute=0, second=0, microsecond=0)
-        fxx = target_hour + 6  # Hours from yesterday 18Z
-    
-    # Ensure the initialization time is not in the future considering processing delay
-    if init_date_utc + datetime.timedelta(hours=processing_delay_hours) > now_utc:
-        print(f"Calculated init time {init_date_utc} is too recent, falling back to previous run")
-        # Fall back to previous 6-hour cycle
-        if init_hour > 0:
-            prev_init_hour = max([h for h in gfs_init_hours if h < init_hour])
-            init_date_utc = target_date_utc.replace(hour=prev_init_hour, minute=0, second=0, microsecond=0)
-            fxx = target_hour - prev_init_hour
-        else:
-            # Fall back to yesterday's 18Z run
-            init_date_utc = (target_date_utc - datetime.timedelta(days=1)).replace(hour=18, minute=0, second=0, microsecond=0)
-            fxx = target_hour + 6
-    
-    # Cap forecast hours at reasonable limits (GFS forecasts go out to ~384 hours)
-    if fxx > 120:  # Use max 5-day forecast for better data availability
-        print(f"Forecast hour {fxx} is too far out, adjusting to more recent data")
-        # Adjust to use a more recent initialization with shorter forecast
-        while fxx > 120 and init_date_utc > target_date_utc - datetime.timedelta(days=3):
-            init_date_utc -= datetime.timedelta(hours=6)
-            fxx += 6
-    
+    target_date_utc, init_date_utc, fxx = gfs_planner.resolve_cycle(target_date_utc, gfs_planner.planning_now())
     print(f"Final GFS initialization: {init_date_utc}, forecast hour: {fxx}")
+    return target_date_utc, init_date_utc, fxx
+
+def process_wind_data(lat, lon, date, level=850):
+    print(f"Processing wind data request: lat={lat}, lon={lon}, date={date}, level={level}")
+    _request_state.cache_outcome = 'error'
+    
+    run = resolve_gfs_run(date)
+    if run is None:
+        return None
+    target_date_utc, init_date_utc, fxx = run
     
     # Convert to naive datetime for Herbie (it expects naive UTC datetimes)
     init_date_naive = init_date_utc.replace(tzinfo=None)
     
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(script_dir, '..', 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    # Generate filename
-    date_str = init_date_naive.strftime("%Y%m%d%H")
-    if fxx > 0:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_f{fxx:03d}_{level}mb.json")
-    else:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_{level}mb.json")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    filename = velocity_filename(init_date_naive, fxx, level)
+    cache_key = os.path.splitext(os.path.basename(filename))[0]
     
     print(f"Looking for cached file: {filename}")
     
-    # Check if file already exists and is recent
+    result = load_cached_velocity_data(cache_key, filename, cache_max_age(init_date_naive))
+    if result is not None:
+        _request_state.cache_outcome = 'hit'
+        return result
     if os.path.exists(filename):
-        try:
-            # Check if file is recent (less than 6 hours old)
-            file_age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(filename))
-            if file_age < datetime.timedelta(hours=6):
-                print(f"Loading recent cached file: {filename}")
-                with open(filename, "r") as f:
-                    return json.load(f)
-            else:
-                print(f"Cached file is old ({file_age}), fetching new data...")
-        except Exception as e:
-            print(f"Error loading cached file: {e}")
-    
-    print("Fetching new GFS data...")
-    
-    # Try multiple forecast hours if the exact one fails (for robustness)
-    for attempt_fxx in [fxx, max(0, fxx-1), max(0, fxx-2), fxx+1, fxx+2]:
-        try:
-            print(f"Attempting to fetch GFS data with fxx={attempt_fxx}")
-            gfs_data = fetch_gfs_data(lat, lon, init_date_naive, attempt_fxx, level)
-            
-            if gfs_data is not None:
-                print(f"Successfully fetched GFS data with fxx={attempt_fxx}, processing...")
-                
-                # Check if we have the required variables
-                if 'u' not in gfs_data or 'v' not in gfs_data:
-                    print("Error: GFS data missing u or v components")
-                    print(f"Available variables: {list(gfs_data.keys())}")
-                    continue
-                
-                u = gfs_data['u']
-                v = gfs_data['v']
-
-                lon_step = float(gfs_data.longitude[1] - gfs_data.longitude[0])
-                lat_step = float(gfs_data.latitude[0] - gfs_data.latitude[1])  # lat is decreasing
-
-                velocity_u = convert_wind_to_velocity_json(u, "u", level, target_date_utc, init_date_utc, lon_step, lat_step)
-                velocity_v = convert_wind_to_velocity_json(v, "v", level, target_date_utc, init_date_utc, lon_step, lat_step)
-
-                result = [velocity_u, velocity_v]
-                
-                # Save to cache
-                try:
-                    with open(filename, "w") as f:
-                        json.dump(result, f, indent=2)
-                    print(f"Saved weather data to: {filename}")
-                except Exception as e:
-                    print(f"Warning: Could not save cached file: {e}")
-                
-                print(f"Successfully processed wind data - returning {len(result)} components")
-                return result
+        _request_state.cache_outcome = 'stale'
+    
+    # Only one worker builds a given file; the others wait here and then read it
+    with SHARED_CACHE.single_flight(cache_key):
+        result = load_cached_velocity_data(cache_key, filename, cache_max_age(init_date_naive))
+        if result is not None:
+            print("Cached file was built by another worker")
+            _request_state.cache_outcome = 'hit'
+            return result
+        
+        print("Fetching new GFS data...")
+        
+        # Try multiple forecast hours if the exact one fails (for robustness)
+        for attempt_fxx in [fxx, max(0, fxx-1), max(0, fxx-2), fxx+1, fxx+2]:
+            try:
+                print(f"Attempting to fetch GFS data with fxx={attempt_fxx}")
+                wind_grid = get_wind_grid(init_date_naive, attempt_fxx, level)
                 
-        except Exception as e:
-            print(f"Attempt with fxx={attempt_fxx} failed: {e}")
-            continue
+                if wind_grid is not None:
+                    print(f"Successfully fetched GFS data with fxx={attempt_fxx}, processing...")
+                    
+                    grid, grid_meta = wind_grid
+                    result = convert_grid_to_velocity_json(grid, grid_meta, level, target_date_utc, init_date_utc)
+                    save_velocity_data(result, filename)
+                    
+                    print(f"Successfully processed wind data - returning {len(result)} components")
+                    if _request_state.cache_outcome != 'stale':
+                        _request_state.cache_outcome = 'miss'
+                    return result
+                    
+            except Exception as e:
+                print(f"Attempt with fxx={attempt_fxx} failed: {e}")
+                continue
     
     print("Failed to fetch GFS data with all attempted forecast hours")
-    return None(__file__)
-    data_dir = os.path.join(script_dir, '..', 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    # Generate filename
-    date_str = init_date_naive.strftime("%Y%m%d%H")
+    return None
+
+def load_cached_velocity_data(cache_key, filename, max_age=CACHE_MAX_AGE_SECONDS):
+    """Return cached velocity JSON if it is in the shared cache and not expired, else None"""
+    try:
+        entry = SHARED_CACHE.lookup(cache_key, filename, max_age)
+        if entry is None:
+            return None
+        print(f"Loading recent cached file: {filename}")
+        with open(entry["path"], "r") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading cached file: {e}")
+        return None
+
+def velocity_filename(init_date, fxx, level):
+    """Path of the cached velocity JSON for a GFS cycle, forecast hour and level"""
+    date_str = init_date.strftime("%Y%m%d%H")
     if fxx > 0:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_f{fxx:03d}_{level}mb.json")
-    else:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_{level}mb.json")
-    
-    print(f"Looking for cached file: {filename}")
-    
-    # Check if file already exists and is recent
-    if os.path.exists(filename):
-        try:
-            # Check if file is recent (less than 6 hours old)
-            file_age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(filename))
-            if file_age < datetime.timedelta(hours=6):
-                print(f"Loading recent cached file: {filename}")
-                with open(filename, "r") as f:
-                    return json.load(f)
-            else:
-                print(f"Cached file is old ({file_age}), fetching new data...")
-        except Exception as e:
-            print(f"Error loading cached file: {e}")
-    
-    print("Fetching new GFS data...")
-    
-    # Try multiple forecast hours if the exact one fails (for robustness)
-    for attempt_fxx in [fxx, max(0, fxx-1), max(0, fxx-2), fxx+1, fxx+2]:
-        try:
-            print(f"Attempting to fetch GFS data with fxx={attempt_fxx}")
-            gfs_data = fetch_gfs_data(lat, lon, init_date_naive, attempt_fxx, level)
-            
-            if gfs_data is not None:
-                print(f"Successfully fetched GFS data with fxx={attempt_fxx}, processing...")
-                
-                # Check if we have the required variables
-                if 'u' not in gfs_data or 'v' not in gfs_data:
-                    print("Error: GFS data missing u or v components")
-                    print(f"Available variables: {list(gfs_data.keys())}")
-                    continue
-                
-                u = gfs_data['u']
-                v = gfs_data['v']
+        return os.path.join(DATA_DIR, f"gfs_velocity_{date_str}_f{fxx:03d}_{level}mb.json")
+    return os.path.join(DATA_DIR, f"gfs_velocity_{date_str}_{level}mb.json")
 
-                lon_step = float(gfs_data.longitude[1] - gfs_data.longitude[0])
-                lat_step = float(gfs_data.latitude[0] - gfs_data.latitude[1])  # lat is decreasing
+def grid_filename(init_date, fxx, level):
+    """Path of the cached decoded u/v grid (.npy) for a GFS cycle, forecast hour and level"""
+    date_str = init_date.strftime("%Y%m%d%H")
+    return os.path.join(DATA_DIR, f"gfs_grid_{date_str}_f{fxx:03d}_{level}mb.npy")
 
-                velocity_u = convert_wind_to_velocity_json(u, "u", level, target_date_utc, init_date_utc, lon_step, lat_step)
-                velocity_v = convert_wind_to_velocity_json(v, "v", level, target_date_utc, init_date_utc, lon_step, lat_step)
+def grid_from_dataset(gfs_data):
+    """Stack a fetched u/v dataset into a (2, lat, lon) array plus grid metadata"""
+    # Check if we have the required variables
+    if 'u' not in gfs_data or 'v' not in gfs_data:
+        print("Error: GFS data missing u or v components")
+        print(f"Available variables: {list(gfs_data.keys())}")
+        return None
 
-                result = [velocity_u, velocity_v]
-                
-                # Save to cache
-                try:
-                    with open(filename, "w") as f:
-                        json.dump(result, f, indent=2)
-                    print(f"Saved weather data to: {filename}")
-                except Exception as e:
-                    print(f"Warning: Could not save cached file: {e}")
-                
-                print(f"Successfully processed wind data - returning {len(result)} components")
-                return result
-                
-        except Exception as e:
-            print(f"Attempt with fxx={attempt_fxx} failed: {e}")
-            continue
-    
-    print("Failed to fetch GFS data with all attempted forecast hours")
-    return None(__file__)
-    data_dir = os.path.join(script_dir, '..', 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    # Generate filename
-    date_str = init_date_naive.strftime("%Y%m%d%H")
-    if fxx > 0:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_f{fxx:03d}_{level}mb.json")
-    else:
-        filename = os.path.join(data_dir, f"gfs_velocity_{date_str}_{level}mb.json")
-    
-    print(f"Looking for cached file: {filename}")
-    
-    # Check if file already exists and is recent
-    if os.path.exists(filename):
-        try:
-            # Check if file is recent (less than 6 hours old)
-            file_age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(filename))
-            if file_age < datetime.timedelta(hours=6):
-                print(f"Loading recent cached file: {filename}")
-                with open(filename, "r") as f:
-                    return json.load(f)
-            else:
-                print(f"Cached file is old ({file_age}), fetching new data...")
-        except Exception as e:
-            print(f"Error loading cached file: {e}")
-    
-    print("Fetching new GFS data...")
-    
-    try:
-        gfs_data = fetch_gfs_data(lat, lon, init_date_naive, fxx, level)
-        
-        if gfs_data is not None:
-            print("Successfully fetched GFS data, processing...")
-            
-            # Check if we have the required variables
-            if 'u' not in gfs_data or 'v' not in gfs_data:
-                print("Error: GFS data missing u or v components")
-                print(f"Available variables: {list(gfs_data.keys())}")
-                return None
-            
-            u = gfs_data['u']
-            v = gfs_data['v']
+    # Map longitudes to -180..180 and find where the reordered axis starts
+    longitude = ((np.asarray(gfs_data.longitude, dtype=np.float64) + 180) % 360) - 180
+    latitude = np.asarray(gfs_data.latitude, dtype=np.float64)
+    split = int(np.argmin(longitude))
+    tail = len(longitude) - split
 
-            lon_step = float(gfs_data.longitude[1] - gfs_data.longitude[0])
-            lat_step = float(gfs_data.latitude[0] - gfs_data.latitude[1])  # lat is decreasing
+    # Copy u and v straight into one float32 (2, lat, lon) array, rolling as we go
+    grid = np.empty((2, len(latitude), len(longitude)), dtype=np.float32)
+    for i, name in enumerate(('u', 'v')):
+        values = gfs_data[name].values
+        grid[i, :, :tail] = values[:, split:]
+        grid[i, :, tail:] = values[:, :split]
 
-            velocity_u = convert_wind_to_velocity_json(u, "u", level, target_date_utc, init_date_utc, lon_step, lat_step)
-            velocity_v = convert_wind_to_velocity_json(v, "v", level, target_date_utc, init_date_utc, lon_step, lat_step)
+    grid_meta = {
+        "nx": len(longitude),
+        "ny": len(latitude),
+        "lo1": float(longitude[split]),
+        "la1": float(latitude.max()),
+        "lo2": float(longitude[split - 1]),
+        "la2": float(latitude.min()),
+        "dx": float(gfs_data.longitude[1] - gfs_data.longitude[0]),
+        "dy": float(latitude[0] - latitude[1]),  # lat is decreasing
+    }
+    return grid, grid_meta
 
-            result = [velocity_u, velocity_v]
-            
-            # Save to cache
-            try:
-                with open(filename, "w") as f:
-                    json.dump(result, f, indent=2)
-                print(f"Saved weather data to: {filename}")
-            except Exception as e:
-                print(f"Warning: Could not save cached file: {e}")
-            
-            print(f"Successfully processed wind data - returning {len(result)} components")
-            return result
-        else:
-            print("Failed to fetch GFS data from Herbie")
-            return None
-            
-    except Exception as e:
-        print(f"Error processing wind data: {e}")
-        import traceback
-        traceback.print_exc()
+def get_wind_grid(init_date, fxx, level=850):
+    """Return (grid, grid_meta) for a cycle from the shared cache, fetching it at most once across workers"""
+    wind_grid = load_wind_grids(init_date, fxx, [level])[level]
+    if wind_grid is None:
+        wind_grid = fetch_wind_grids(init_date, fxx, [level])[level]
+    return wind_grid
+
+def store_wind_grid(init_date, fxx, level, gfs_data):
+    """Decode a fetched single-level dataset into the shared grid cache, returning (grid, grid_meta) or None"""
+    decoded = grid_from_dataset(gfs_data)
+    if decoded is None:
         return None
+    path = grid_filename(init_date, fxx, level)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    wind_grid = SHARED_CACHE.save_grid(os.path.splitext(os.path.basename(path))[0], path, *decoded)
+    enforce_cache_limit()
+    return wind_grid
+
+def load_wind_grids(init_date, fxx, levels):
+    """Return {level: (grid, grid_meta) or None} for the levels of one (cycle, fxx) already in the shared cache"""
+    wind_grids = {}
+    for level in levels:
+        path = grid_filename(init_date, fxx, level)
+        wind_grids[level] = SHARED_CACHE.load_grid(os.path.splitext(os.path.basename(path))[0], path,
+                                                   cache_max_age(init_date))
+    return wind_grids
+
+def fetch_wind_grids(init_date, fxx, levels):
+    """Fetch the given levels of one (cycle, fxx) in a single GRIB read and cache each, holding every level's lock"""
+    with ExitStack() as stack:
+        # Sorted so two callers never wait on each other's locks
+        for level in sorted(levels):
+            path = grid_filename(init_date, fxx, level)
+            stack.enter_context(SHARED_CACHE.single_flight(os.path.splitext(os.path.basename(path))[0]))
+
+        wind_grids = load_wind_grids(init_date, fxx, levels)
+        missing = [level for level in levels if wind_grids[level] is None]
+        if not missing:
+            return wind_grids
+
+        datasets = fetch_gfs_levels(init_date, fxx, missing) or {}
+        for level in missing:
+            if level in datasets:
+                wind_grids[level] = store_wind_grid(init_date, fxx, level, datasets[level])
+                _request_state.cache_built = True
+        return wind_grids
+
+def convert_grid_to_velocity_json(grid, grid_meta, level, target_date, init_date):
+    """Convert a (2, lat, lon) u/v grid into the [u, v] velocity JSON pair"""
+    velocity_u = convert_wind_to_velocity_json(grid[0], "u", level, target_date, init_date, grid_meta)
+    velocity_v = convert_wind_to_velocity_json(grid[1], "v", level, target_date, init_date, grid_meta)
+    return [velocity_u, velocity_v]
 
-def convert_wind_to_velocity_json(var, component_name, level, target_date, init_date, lon_step, lat_step):
+def save_velocity_data(result, filename):
+    """Write a velocity JSON pair to the shared cache, returning the bytes written"""
+    try:
+        cache_key = os.path.splitext(os.path.basename(filename))[0]
+        nbytes = SHARED_CACHE.write_atomic(filename, lambda f: json.dump(result, f, indent=2), mode="w")
+        SHARED_CACHE.record(cache_key, filename, nbytes)
+        print(f"Saved weather data to: {filename}")
+        enforce_cache_limit()
+        return nbytes
+    except Exception as e:
+        print(f"Warning: Could not save cached file: {e}")
+        return 0
+
+def velocity_header(component_name, level, target_date, init_date, grid_meta):
+    """Build the leaflet-velocity header for one wind component"""
     # Calculate forecast hour properly with timezone-aware datetimes
     if hasattr(target_date, 'tzinfo') and hasattr(init_date, 'tzinfo'):
         forecast_hour = int((target_date - init_date).total_seconds() // 3600)
@@ -356,35 +410,467 @@ def convert_wind_to_velocity_json(var, component_name, level, target_date, init_
         "surface1TypeName": "Isobaric surface",
         "surface1Value": level,
         "gridDefinition": "Latitude_Longitude",
-        "nx": var.sizes["longitude"],
-        "ny": var.sizes["latitude"],
-        "lo1": float(var.longitude.min()),
-        "la1": float(var.latitude.max()),
-        "lo2": float(var.longitude.max()),
-        "la2": float(var.latitude.min()),
-        "dx": lon_step,
-        "dy": lat_step,
+        "nx": grid_meta["nx"],
+        "ny": grid_meta["ny"],
+        "lo1": grid_meta["lo1"],
+        "la1": grid_meta["la1"],
+        "lo2": grid_meta["lo2"],
+        "la2": grid_meta["la2"],
+        "dx": grid_meta["dx"],
+        "dy": grid_meta["dy"],
         "unit": "m/s"
     }
+    return header
 
-    # Convert data to list, handling potential NaN values
-    data_array = var.values.flatten(order="C")
-    data = []
-    for value in data_array:
-        if hasattr(value, 'item'):  # numpy scalar
-            val = value.item()
-        else:
-            val = float(value)
-        
-        # Replace NaN/inf with None for JSON serialization
-        if not (val == val):  # Check for NaN
-            data.append(None)
-        elif val == float('inf') or val == float('-inf'):
-            data.append(None)
-        else:
-            data.append(val)
+def convert_wind_to_velocity_json(values, component_name, level, target_date, init_date, grid_meta):
+    header = velocity_header(component_name, level, target_date, init_date, grid_meta)
+
+    # Convert data to list (ravel is a view for contiguous grids), replacing NaN/inf with None
+    values = np.asarray(values).ravel()
+    data = values.tolist()
+    invalid = np.flatnonzero(~np.isfinite(values))
+    for i in invalid.tolist():
+        data[i] = None
 
     return {
         "header": header,
         "data": data
-    }
\ No newline at end of file
+    }
+
+def crop_wind_grid(grid, grid_meta, bounds):
+    """Slice a (..., lat, lon) grid to (north, south, west, east) bounds as a view, with matching metadata"""
+    if bounds is None:
+        return grid, grid_meta
+
+    north, south, west, east = bounds
+    dx, dy = grid_meta["dx"], grid_meta["dy"]
+    row_start = max(0, int(np.floor((grid_meta["la1"] - north) / dy)))
+    row_end = min(grid_meta["ny"], int(np.ceil((grid_meta["la1"] - south) / dy)) + 1)
+    col_start = max(0, int(np.floor((west - grid_meta["lo1"]) / dx)))
+    col_end = min(grid_meta["nx"], int(np.ceil((east - grid_meta["lo1"]) / dx)) + 1)
+    if row_end <= row_start or col_end <= col_start:
+        raise ValueError(f"Bounds {bounds} do not overlap the GFS grid")
+
+    cropped_meta = dict(
+        grid_meta,
+        nx=col_end - col_start,
+        ny=row_end - row_start,
+        lo1=grid_meta["lo1"] + col_start * dx,
+        lo2=grid_meta["lo1"] + (col_end - 1) * dx,
+        la1=grid_meta["la1"] - row_start * dy,
+        la2=grid_meta["la1"] - (row_end - 1) * dy,
+    )
+    return grid[..., row_start:row_end, col_start:col_end], cropped_meta
+
+def prepare_animation_frame(init_date_utc, fxx, level, bounds):
+    """Fetch and crop one forecast hour of a run, or return None"""
+    init_date_naive = init_date_utc.replace(tzinfo=None)
+    try:
+        # Nearby forecast hours stand in only when this one is missing
+        for attempt_fxx in [fxx, max(0, fxx-1), max(0, fxx-2), fxx+1, fxx+2]:
+            wind_grid = get_wind_grid(init_date_naive, attempt_fxx, level)
+            if wind_grid is not None:
+                grid, grid_meta = crop_wind_grid(*wind_grid, bounds)
+                valid_date_utc = init_date_utc + datetime.timedelta(hours=attempt_fxx)
+                return valid_date_utc, init_date_utc, grid, grid_meta
+    except Exception as e:
+        print(f"Error preparing animation frame for {init_date_utc} f{fxx:03d}: {e}")
+    return None
+
+def quantize_wind(grid):
+    """Quantize wind values to integer steps of ANIMATION_SCALE, rounding half up like JS Math.round"""
+    values = np.nan_to_num(np.asarray(grid, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+    return np.floor(values / ANIMATION_SCALE + 0.5).astype(np.int32)
+
+def _encode_delta(delta):
+    return base64.b64encode(delta.astype("<i2").tobytes()).decode("ascii")
+
+def iter_animation_frames(start, hours, step=1, level=850, bounds=None):
+    """
+    Yield animation frames for start .. start+hours every step hours.
+
+    The GFS run is resolved once from start and each frame steps the
+    forecast hour within that run; frame datetimes are the valid times.
+
+    The first frame (and any frame whose grid shape changes) is a full
+    leaflet-velocity [u, v] pair. Later frames are deltas: values are
+    quantized as q = floor(value / scale + 0.5) and each delta frame carries
+    q_now - q_previous as little-endian int16, base64-encoded, where
+    q_previous is what the client has reconstructed so far. Frames are
+    prepared on a thread pool so playback can start while later ones are
+    still downloading.
+    """
+    run = resolve_gfs_run(start)
+    if run is None:
+        yield {"type": "error", "message": f"Invalid start datetime: {start}"}
+        return
+
+    # Every frame comes from the run that covers start, so hours past the latest
+    # available analysis are real forecast steps rather than the same grid repeated
+    _, init_date_utc, start_fxx = run
+    forecast_hours = [start_fxx + h for h in range(0, hours + 1, step)]
+    executor = ThreadPoolExecutor(max_workers=ANIMATION_WORKERS)
+    try:
+        frames = executor.map(lambda fxx: prepare_animation_frame(init_date_utc, fxx, level, bounds), forecast_hours)
+        previous = None
+        sent = 0
+        for index, (fxx, frame) in enumerate(zip(forecast_hours, frames)):
+            if frame is None:
+                frame_time = init_date_utc + datetime.timedelta(hours=fxx)
+                yield {"type": "error", "index": index, "datetime": frame_time.isoformat(),
+                       "message": "Failed to fetch weather data"}
+                continue
+
+            target_date_utc, init_date_utc, grid, grid_meta = frame
+            frame_time = target_date_utc
+            quantized = quantize_wind(grid)
+            if previous is None or previous.shape != quantized.shape:
+                yield {
+                    "type": "frame",
+                    "index": index,
+                    "datetime": frame_time.isoformat(),
+                    "data": convert_grid_to_velocity_json(grid, grid_meta, level, target_date_utc, init_date_utc),
+                }
+                previous = quantized
+            else:
+                delta = np.clip(quantized - previous, -32768, 32767)
+                # Track what the client reconstructs, so clipped deltas cannot drift
+                previous = previous + delta
+                yield {
+                    "type": "delta",
+                    "index": index,
+                    "datetime": frame_time.isoformat(),
+                    "headers": [
+                        velocity_header("u", level, target_date_utc, init_date_utc, grid_meta),
+                        velocity_header("v", level, target_date_utc, init_date_utc, grid_meta),
+                    ],
+                    "scale": ANIMATION_SCALE,
+                    "encoding": "int16-le-base64",
+                    "u": _encode_delta(delta[0]),
+                    "v": _encode_delta(delta[1]),
+                }
+            sent += 1
+        yield {"type": "end", "frames": sent}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def get_wind_cube(init_date, fxx, levels=MIGRATION_LEVELS, bounds=None):
+    """Stack the cached grids for every level into a (level, 2, lat, lon) cube, cropped to bounds, or return None"""
+    wind_grids = load_wind_grids(init_date, fxx, levels)
+    missing = [level for level in levels if wind_grids[level] is None]
+    if missing:
+        wind_grids.update(fetch_wind_grids(init_date, fxx, missing))
+    if any(wind_grids[level] is None for level in levels):
+        return None
+    # Crop the memory-mapped grids first so only the region is copied into the cube
+    cropped = [crop_wind_grid(*wind_grids[level], bounds) for level in levels]
+    return np.stack([grid for grid, _ in cropped]), cropped[0][1]
+
+def compute_wind_products(cube):
+    """Speed, meteorological direction and inter-level shear for every level of a wind cube"""
+    u = cube[:, 0]
+    v = cube[:, 1]
+    speed = np.hypot(u, v)
+    # Direction the wind blows from, clockwise from north
+    direction = np.mod(270.0 - np.degrees(np.arctan2(v, u)), 360.0).astype(np.float32)
+    # Vector difference between each level and the one above it
+    shear = np.hypot(np.diff(u, axis=0), np.diff(v, axis=0))
+    return speed, direction, shear
+
+def compute_best_tailwind(cube, levels, heading):
+    """Pick, per grid point, the level with the strongest tailwind for a flight heading in degrees"""
+    heading_rad = np.radians(heading)
+    # Component of the wind along the direction of travel
+    tailwind = cube[:, 0] * np.float32(np.sin(heading_rad)) + cube[:, 1] * np.float32(np.cos(heading_rad))
+    best_index = np.argmax(tailwind, axis=0)[np.newaxis]
+    best_tailwind = np.take_along_axis(tailwind, best_index, axis=0)[0]
+    best_u = np.take_along_axis(cube[:, 0], best_index, axis=0)[0]
+    best_v = np.take_along_axis(cube[:, 1], best_index, axis=0)[0]
+    best_level = np.asarray(levels, dtype=np.float32)[best_index[0]]
+    return best_u, best_v, best_tailwind, best_level
+
+def get_wind_products(init_date, fxx):
+    """Return cached (layers, meta) of speed, direction and shear for a cycle, building them once across workers"""
+    name = f"gfs_products_{init_date.strftime('%Y%m%d%H')}_f{fxx:03d}"
+    path = os.path.join(DATA_DIR, f"{name}.npy")
+
+    products = SHARED_CACHE.load_grid(name, path, cache_max_age(init_date))
+    if products is not None:
+        return products
+
+    with SHARED_CACHE.single_flight(name):
+        products = SHARED_CACHE.load_grid(name, path, cache_max_age(init_date))
+        if products is not None:
+            return products
+
+        wind_cube = get_wind_cube(init_date, fxx)
+        if wind_cube is None:
+            return None
+        cube, grid_meta = wind_cube
+
+        speed, direction, shear = compute_wind_products(cube)
+        layers = np.concatenate([speed, direction, shear])
+        meta = dict(grid_meta, levels=MIGRATION_LEVELS)
+        products = SHARED_CACHE.save_grid(name, path, layers, meta)
+        _request_state.cache_built = True
+        enforce_cache_limit()
+        return products
+
+def product_record(values, name, unit, parameter_number, level, target_date, init_date, grid_meta):
+    """Wrap a derived scalar grid in the same header/data record as the wind components"""
+    record = convert_wind_to_velocity_json(values, "u", level, target_date, init_date, grid_meta)
+    record["header"].update({
+        "parameterCategory": 2 if parameter_number in (0, 1) else 255,
+        "parameterCategoryName": "Momentum" if parameter_number in (0, 1) else "Derived migration products",
+        "parameterNumber": parameter_number,
+        "parameterNumberName": name,
+        "parameterUnit": unit,
+        "unit": unit,
+    })
+    return record
+
+def mark_mixed_levels(record):
+    """Relabel a record whose values come from a different pressure level at each point"""
+    record["header"].update({
+        "surface1Type": 255,
+        "surface1TypeName": "Mixed isobaric levels (best tailwind level per point)",
+        "surface1Value": None,
+    })
+    return record
+
+def process_wind_product(lat, lon, date, product, level=850, heading=None, bounds=None):
+    """
+    Serve one derived layer computed from the multi-level wind cube.
+
+    speed, direction and shear are returned for the requested level (shear
+    is the vector difference to the next level up). tailwind returns the u/v
+    wind at the best level for the given heading (usable directly as a
+    velocity layer) followed by the tailwind speed and the chosen level;
+    it is computed per request from the cached level grids, so it needs
+    (north, south, west, east) bounds to keep each request to one region.
+    """
+    print(f"Processing wind product request: product={product}, date={date}, level={level}, heading={heading}")
+    _request_state.cache_outcome = 'error'
+    _request_state.cache_built = False
+
+    if product not in WIND_PRODUCTS:
+        raise ValueError(f"Unknown product '{product}', expected one of {', '.join(WIND_PRODUCTS)}")
+    if product == "tailwind" and heading is None:
+        raise ValueError("The tailwind product needs a heading in degrees")
+    if product == "tailwind" and not np.isfinite(heading):
+        raise ValueError(f"Heading must be a finite number of degrees, got {heading}")
+    if product == "tailwind" and bounds is None:
+        raise ValueError("The tailwind product needs a region: north, south, west, east")
+    if product != "tailwind" and level not in MIGRATION_LEVELS:
+        raise ValueError(f"Level {level} is not one of {MIGRATION_LEVELS}")
+    if product == "shear" and level == MIGRATION_LEVELS[-1]:
+        raise ValueError(f"No level above {level} mb to compute shear against")
+
+    run = resolve_gfs_run(date)
+    if run is None:
+        return None
+    target_date_utc, init_date_utc, fxx = run
+    init_date_naive = init_date_utc.replace(tzinfo=None)
+
+    for attempt_fxx in [fxx, max(0, fxx-1), max(0, fxx-2), fxx+1, fxx+2]:
+        if product == "tailwind":
+            result = get_wind_cube(init_date_naive, attempt_fxx, bounds=bounds)
+        else:
+            result = get_wind_products(init_date_naive, attempt_fxx)
+        if result is not None:
+            break
+    else:
+        print("Failed to build wind products with all attempted forecast hours")
+        return None
+
+    _request_state.cache_outcome = 'miss' if _request_state.cache_built else 'hit'
+    layers, grid_meta = result
+    args = (target_date_utc, init_date_utc, grid_meta)
+
+    if product == "tailwind":
+        best_u, best_v, best_tailwind, best_level = compute_best_tailwind(layers, MIGRATION_LEVELS, heading % 360)
+        return [mark_mixed_levels(record) for record in [
+            convert_wind_to_velocity_json(best_u, "u", level, *args),
+            convert_wind_to_velocity_json(best_v, "v", level, *args),
+            product_record(best_tailwind, f"Best_level_tailwind_heading_{heading % 360:g}", "m.s-1", 193, level, *args),
+            product_record(best_level, "Best_tailwind_level", "hPa", 194, level, *args),
+        ]]
+
+    n_levels = len(grid_meta["levels"])
+    index = grid_meta["levels"].index(level)
+    if product == "speed":
+        return [product_record(layers[index], "Wind_speed", "m.s-1", 1, level, *args)]
+    if product == "direction":
+        return [product_record(layers[n_levels + index], "Wind_direction_from_which_blowing", "degree", 0, level, *args)]
+    return [product_record(layers[2 * n_levels + index], "Vertical_wind_shear", "m.s-1", 192, level, *args)]
+
+def backfill_group(init_date, fxx, levels):
+    """Fetch and convert every level of one (cycle, fxx), returning {level: bytes written or None}"""
+    wind_grids = load_wind_grids(init_date, fxx, levels)
+    # Levels not already decoded come from one read of the GRIB file
+    missing = [level for level in levels if wind_grids[level] is None]
+    if missing:
+        wind_grids.update(fetch_wind_grids(init_date, fxx, missing))
+
+    init_date_utc = init_date.replace(tzinfo=ZoneInfo('UTC'))
+    target_date_utc = init_date_utc + datetime.timedelta(hours=fxx)
+    written = {}
+    for level in levels:
+        if wind_grids[level] is None:
+            written[level] = None
+            continue
+        result = convert_grid_to_velocity_json(*wind_grids[level], level, target_date_utc, init_date_utc)
+        written[level] = save_velocity_data(result, velocity_filename(init_date, fxx, level))
+    return written
+
+def _manifest_key(init_date, fxx, level):
+    return f"{init_date.strftime('%Y%m%d%H')}_f{fxx:03d}_{level}mb"
+
+def load_backfill_manifest(manifest_path):
+    """Return the set of item keys already completed in a backfill manifest"""
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["key"])
+            except (ValueError, KeyError):
+                continue
+    return completed
+
+def run_backfill(start_date, end_date, levels, forecast_hours, cycles=(0, 6, 12, 18), workers=4, manifest_path=None):
+    """Download and convert every (cycle, fxx, level) between two dates with a bounded worker pool"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(DATA_DIR, "backfill_manifest.jsonl")
+    completed = load_backfill_manifest(manifest_path)
+
+    latest_cycle = (datetime.datetime.now(ZoneInfo("UTC")).replace(tzinfo=None)
+                    - datetime.timedelta(hours=gfs_planner.PROCESSING_DELAY_HOURS))
+    items = []
+    skipped = 0
+    day = start_date
+    while day <= end_date:
+        for hour in cycles:
+            init_date = datetime.datetime(day.year, day.month, day.day, hour)
+            if init_date > latest_cycle:
+                continue
+            for fxx in forecast_hours:
+                for level in levels:
+                    if (_manifest_key(init_date, fxx, level) in completed
+                            or os.path.exists(velocity_filename(init_date, fxx, level))):
+                        skipped += 1
+                        continue
+                    items.append((init_date, fxx, level))
+        day += datetime.timedelta(days=1)
+
+    print(f"Backfill: {len(items)} items to fetch, {skipped} already done, {workers} workers")
+    return run_fetch_items(items, workers, manifest_path)
+
+def run_prefetch(log_path, workers=4, manifest_path=None):
+    """Fetch everything a request log (see REQUEST_LOG_PATH) would need, in fetch-plan order"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(DATA_DIR, "backfill_manifest.jsonl")
+    completed = load_backfill_manifest(manifest_path)
+
+    requests = []
+    with open(log_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("datetime"):
+                continue
+            # Derived products are built from the wind cube, which needs every migration level
+            levels = MIGRATION_LEVELS if record.get("product") else [record.get("level") or 850]
+            requests.extend((record["datetime"], level) for level in levels)
+
+    plan = gfs_planner.plan_fetches(requests)
+    items = [item for item in plan.fetches
+             if _manifest_key(*item) not in completed and not os.path.exists(velocity_filename(*item))]
+    print(f"Prefetch: {len(requests)} logged (datetime, level) requests -> {len(plan.fetches)} unique fetches, "
+          f"{len(plan.fetches) - len(items)} already done, {workers} workers")
+    return run_fetch_items(items, workers, manifest_path)
+
+def run_fetch_items(items, workers, manifest_path):
+    """Run (init_date, fxx, level) items on a process pool, recording each success in the manifest"""
+    print(f"Manifest: {manifest_path}")
+    if not items:
+        return 0
+
+    # Every level of one (cycle, fxx) lives in the same GRIB file, so each group is fetched in one call
+    groups = {}
+    for init_date, fxx, level in items:
+        groups.setdefault((init_date, fxx), []).append(level)
+
+    done = failed = total_bytes = 0
+    done_cycles = set()
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(backfill_group, init_date, fxx, levels): (init_date, fxx)
+                   for (init_date, fxx), levels in groups.items()}
+        with open(manifest_path, "a") as manifest:
+            for future in as_completed(futures):
+                init_date, fxx = futures[future]
+                try:
+                    written = future.result()
+                except Exception as e:
+                    print(f"Backfill group {init_date.strftime('%Y%m%d%H')}_f{fxx:03d} failed: {e}")
+                    written = {}
+
+                for level in groups[init_date, fxx]:
+                    key = _manifest_key(init_date, fxx, level)
+                    nbytes = written.get(level)
+                    if nbytes is None:
+                        failed += 1
+                        continue
+
+                    done += 1
+                    total_bytes += nbytes
+                    done_cycles.add(init_date)
+                    manifest.write(json.dumps({"key": key, "bytes": nbytes, "completed_at": time.time()}) + "\n")
+                    manifest.flush()
+
+                    elapsed = time.perf_counter() - started
+                    print(f"[{done + failed}/{len(items)}] {key}: {nbytes / 1e6:.1f} MB, "
+                          f"{done / elapsed * 60:.1f} items/min")
+    except KeyboardInterrupt:
+        print("\nFetch interrupted - completed items are recorded, rerun to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(f"Fetch finished: {done} done, {failed} failed in {elapsed:.1f} s")
+    print(f"Throughput: {len(done_cycles) / elapsed * 60:.2f} cycles/min, "
+          f"{total_bytes / elapsed / 1e6:.2f} MB/s written")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="GFS wind data tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill", help="Download and convert a historical date range")
+    backfill.add_argument("--start", required=True, type=datetime.date.fromisoformat, help="First day (YYYY-MM-DD)")
+    backfill.add_argument("--end", required=True, type=datetime.date.fromisoformat, help="Last day, inclusive (YYYY-MM-DD)")
+    backfill.add_argument("--levels", type=int, nargs="+", default=[850], help="Pressure levels in mb")
+    backfill.add_argument("--fxx", type=int, nargs="+", default=[0], help="Forecast hours")
+    backfill.add_argument("--cycles", type=int, nargs="+", default=[0, 6, 12, 18], help="GFS init hours")
+    backfill.add_argument("--workers", type=int, default=4, help="Concurrent downloads")
+    backfill.add_argument("--manifest", help="Manifest path (default: data/backfill_manifest.jsonl)")
+    prefetch = subparsers.add_parser("prefetch", help="Fetch the cycles a request log needs, deduplicated")
+    prefetch.add_argument("log", help="JSONL request log written via REQUEST_LOG_PATH")
+    prefetch.add_argument("--workers", type=int, default=4, help="Concurrent downloads")
+    prefetch.add_argument("--manifest", help="Manifest path (default: data/backfill_manifest.jsonl)")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        failed = run_backfill(args.start, args.end, args.levels, args.fxx, args.cycles, args.workers, args.manifest)
+    else:
+        failed = run_prefetch(args.log, args.workers, args.manifest)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from flask_cors import CORS
 import herbie_datagrab
 import traceback
 import os
+import json
+import time
+import threading
 import requests
 from datetime import datetime
 
@@ -24,6 +27,76 @@ if not EBIRD_API_KEY:
 # eBird API base URL
 EBIRD_BASE_URL = "https://api.ebird.org/v2"
 
+# Optional structured request log: one JSON line per weather request
+REQUEST_LOG_PATH = os.getenv('REQUEST_LOG_PATH')
+_request_log_lock = threading.Lock()
+
+# Endpoints whose traffic is recorded in the request log
+LOGGED_ENDPOINTS = ("/api/get_gfs_data", "/api/weather")
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    herbie_datagrab.reset_cache_outcome()
+
+@app.after_request
+def log_request(response):
+    """Append a JSONL record for weather requests when REQUEST_LOG_PATH is set"""
+    if not REQUEST_LOG_PATH or request.method == 'OPTIONS' or request.path not in LOGGED_ENDPOINTS:
+        return response
+
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+        lat, lon, date, level = params.get('lat'), params.get('lon'), params.get('date'), params.get('level', 850)
+    else:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lng', type=float)
+        date = request.args.get('datetime')
+        level = request.args.get('level', default=850, type=int)
+    product = request.args.get('product')
+    heading = request.args.get('heading', type=float)
+    bounds = [request.args.get(name, type=float) for name in ('north', 'south', 'west', 'east')]
+
+    record = {
+        "ts": time.time(),
+        "endpoint": request.path,
+        "method": request.method,
+        "lat": lat,
+        "lon": lon,
+        "datetime": date,
+        "level": level,
+        "product": product,
+        "heading": heading,
+        "bounds": bounds if any(b is not None for b in bounds) else None,
+        "status": response.status_code,
+        "cache": herbie_datagrab.get_last_cache_outcome(),
+        "latency_ms": round((time.perf_counter() - g.get('request_start', time.perf_counter())) * 1000, 2),
+        "bytes": response.calculate_content_length(),
+    }
+
+    try:
+        with _request_log_lock:
+            with open(REQUEST_LOG_PATH, "a") as f:
+                f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"Warning: Could not write request log: {e}")
+
+    return response
+
+def parse_region_args():
+    """Read north/south/west/east query args as bounds (None when all are absent), raising ValueError if invalid"""
+    bounds = [request.args.get(name, type=float) for name in ('north', 'south', 'west', 'east')]
+    if all(b is None for b in bounds):
+        return None
+    if any(b is None for b in bounds):
+        raise ValueError("Region needs all of north, south, west, east")
+    north, south, west, east = bounds
+    if not (-90 <= south < north <= 90) or not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("Region must have -90 <= south < north <= 90 and longitudes within -180..180")
+    if west >= east:
+        raise ValueError("Regions crossing the antimeridian are not supported; request each side separately")
+    return bounds
+
 @app.route("/api/get_gfs_data", methods=["POST", "OPTIONS"])
 def get_gfs_data():
     if request.method == 'OPTIONS':
@@ -66,14 +139,20 @@ def get_weather_for_location():
     lng = request.args.get('lng', type=float)
     datetime_str = request.args.get('datetime')
     level = request.args.get('level', default=850, type=int)
+    product = request.args.get('product')
+    heading = request.args.get('heading', type=float)
     
-    print(f"Weather API request: lat={lat}, lng={lng}, datetime={datetime_str}, level={level}")
+    print(f"Weather API request: lat={lat}, lng={lng}, datetime={datetime_str}, level={level}, product={product}")
     
     if not all([lat, lng, datetime_str]):
         return jsonify({"error": "Missing required parameters: lat, lng, datetime"}), 400
     
     try:
-        result = herbie_datagrab.process_wind_data(lat, lng, datetime_str, level)
+        bounds = parse_region_args() if product else None
+        if product:
+            result = herbie_datagrab.process_wind_product(lat, lng, datetime_str, product, level, heading, bounds)
+        else:
+            result = herbie_datagrab.process_wind_data(lat, lng, datetime_str, level)
         if result is not None:
             return jsonify({
                 "status": "success", 
@@ -83,15 +162,56 @@ def get_weather_for_location():
                     "lng": lng,
                     "datetime": datetime_str,
                     "level": level,
+                    "product": product,
+                    "heading": heading,
+                    "bounds": bounds,
                     "processed_at": datetime.now().isoformat()
                 }
             })
         else:
             return jsonify({"status": "error", "message": "Failed to fetch weather data"}), 500
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Longest time-lapse the animation endpoint will stream, in hours
+MAX_ANIMATION_HOURS = 120
+
+@app.route("/api/weather/animation", methods=["GET", "OPTIONS"])
+def stream_weather_animation():
+    """Stream a series of forecast hours for one level and region as NDJSON frames"""
+    if request.method == 'OPTIONS':
+        response = jsonify({'status': 'ok'})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        return response
+
+    start = request.args.get('datetime')
+    hours = request.args.get('hours', default=24, type=int)
+    step = request.args.get('step', default=1, type=int)
+    level = request.args.get('level', default=850, type=int)
+    print(f"Animation API request: datetime={start}, hours={hours}, step={step}, level={level}")
+
+    if not start:
+        return jsonify({"error": "Missing required parameter: datetime"}), 400
+    if not 0 <= hours <= MAX_ANIMATION_HOURS or step < 1:
+        return jsonify({"error": f"hours must be 0-{MAX_ANIMATION_HOURS} and step at least 1"}), 400
+    if herbie_datagrab.parse_target_date(start) is None:
+        return jsonify({"error": f"Invalid datetime: {start}"}), 400
+    try:
+        bounds = parse_region_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        for frame in herbie_datagrab.iter_animation_frames(start, hours, step, level, bounds):
+            yield json.dumps(frame) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 # Health check endpoint
 @app.route("/api/health", methods=["GET"])
 def health_check():
@@ -100,7 +220,7 @@ def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "ebird_api_configured": EBIRD_API_KEY is not None,
-        "services": ["gfs_data", "weather_api"],
+        "services": ["gfs_data", "weather_api", "weather_animation"],
         "cors_origins": [
             "chrome-extension://adngbbngkdibkmdchidpiajjgljdlgad",
             "https://dafekt1ve.github.io"
@@ -118,6 +238,11 @@ if __name__ == '__main__':
     print("📍 Endpoints available:")
     print("   - POST /api/get_gfs_data (existing)")
     print("   - GET  /api/weather (new - for external website)")
+    print("   - GET  /api/weather/animation (NDJSON frames for time-lapse playback)")
     print("   - GET  /api/health (new - health check)")
+    if herbie_datagrab.LOCAL_GRIB_DIR:
+        print(f"📂 Local GRIB mirror: {herbie_datagrab.LOCAL_GRIB_DIR}{' (offline)' if herbie_datagrab.OFFLINE else ''}")
+    if REQUEST_LOG_PATH:
+        print(f"📝 Request log: {REQUEST_LOG_PATH}")
     
     app.run(debug=True, host="0.0.0.0", port=8000)
\ No newline at end of file
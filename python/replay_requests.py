@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Replay a herbie_server request log for load testing.
+
+Reads the JSONL file written when REQUEST_LOG_PATH is set and sends the same
+requests again, either to the Flask app in-process (with Herbie replaced by a
+local stub that generates synthetic GFS grids) or to a running server via --url.
+
+Examples:
+    python replay_requests.py ../requests.jsonl --concurrency 8 --speedup 10
+    python replay_requests.py ../requests.jsonl --speedup 0 --url http://localhost:8000
+"""
+
+import argparse
+import json
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from shared_cache import SharedCache
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+
+class StubHerbie:
+    """Stand-in for herbie.Herbie that returns a synthetic global u/v grid"""
+
+    resolution = 1.0  # degrees
+    delay = 0.0       # seconds, simulates download time
+
+    def __init__(self, date, model="gfs", fxx=0, **kwargs):
+        self.date = date
+        self.model = model
+        self.fxx = fxx
+
+    def xarray(self, search, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+
+        latitude = np.arange(90, -90 - self.resolution / 2, -self.resolution)
+        longitude = np.arange(0, 360, self.resolution)
+        lon_grid, lat_grid = np.meshgrid(np.radians(longitude), np.radians(latitude))
+        phase = self.fxx / 24.0
+        # Levels come from searches like "(UGRD|VGRD):850 mb" or "(UGRD|VGRD):(925|850) mb"
+        match = re.search(r":\(?([\d|]+)\)? mb", search)
+        levels = [int(level) for level in match.group(1).split("|")] if match else [850]
+        u = np.stack([15 * (level / 850.0) * np.cos(lat_grid) * np.sin(lon_grid + phase) for level in levels])
+        v = np.stack([10 * (level / 850.0) * np.sin(2 * lat_grid) * np.cos(lon_grid - phase) for level in levels])
+
+        # Like cfgrib, one level is a scalar coordinate and several are a dimension
+        coords = {"latitude": latitude, "longitude": longitude}
+        if len(levels) == 1:
+            dims = ("latitude", "longitude")
+            u, v = u[0], v[0]
+            coords["isobaricInhPa"] = levels[0]
+        else:
+            dims = ("isobaricInhPa", "latitude", "longitude")
+            coords["isobaricInhPa"] = levels
+        return xr.Dataset(
+            {
+                "u": (dims, u.astype(np.float32)),
+                "v": (dims, v.astype(np.float32)),
+            },
+            coords=coords,
+        )
+
+
+class _StubHerbieModule:
+    Herbie = StubHerbie
+
+
+def load_log(path):
+    """Load replayable records from a request log"""
+    records = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping malformed line {line_number}: {e}")
+                continue
+            if record.get("endpoint") in ("/api/weather", "/api/get_gfs_data"):
+                records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(np.ceil(pct / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def weather_params(record):
+    """Query parameters for replaying a GET /api/weather record"""
+    params = {
+        "lat": record.get("lat"),
+        "lng": record.get("lon"),
+        "datetime": record.get("datetime"),
+        "level": record.get("level", 850),
+    }
+    for optional in ("product", "heading"):
+        if record.get(optional) is not None:
+            params[optional] = record[optional]
+    if record.get("bounds"):
+        params.update(zip(("north", "south", "west", "east"), record["bounds"]))
+    return params
+
+
+def make_in_process_sender(data_dir):
+    """Return a send(record) callable that drives herbie_server in-process"""
+    try:
+        import herbie  # noqa: F401
+    except ImportError:
+        sys.modules["herbie"] = _StubHerbieModule
+    import herbie_datagrab
+    import herbie_server
+
+    herbie_datagrab.herbie = _StubHerbieModule
+    herbie_datagrab.DATA_DIR = data_dir
+    herbie_datagrab.SHARED_CACHE = SharedCache(data_dir)
+    clients = threading.local()
+
+    def send(record):
+        if not hasattr(clients, "client"):
+            clients.client = herbie_server.app.test_client()
+        if record["endpoint"] == "/api/get_gfs_data":
+            response = clients.client.post(record["endpoint"], json={
+                "lat": record.get("lat"),
+                "lon": record.get("lon"),
+                "date": record.get("datetime"),
+                "level": record.get("level", 850),
+            })
+        else:
+            response = clients.client.get(record["endpoint"], query_string=weather_params(record))
+        return response.status_code, len(response.get_data())
+
+    return send
+
+
+def make_http_sender(base_url):
+    """Return a send(record) callable that hits a running server"""
+    import requests
+
+    session = requests.Session()
+
+    def send(record):
+        url = base_url.rstrip("/") + record["endpoint"]
+        if record["endpoint"] == "/api/get_gfs_data":
+            response = session.post(url, json={
+                "lat": record.get("lat"),
+                "lon": record.get("lon"),
+                "date": record.get("datetime"),
+                "level": record.get("level", 850),
+            })
+        else:
+            response = session.get(url, params=weather_params(record))
+        return response.status_code, len(response.content)
+
+    return send
+
+
+def replay(records, send, concurrency=4, speedup=1.0):
+    """Replay records honoring their original spacing divided by speedup (0 = no pacing)"""
+    results = []
+    results_lock = threading.Lock()
+
+    def run(record, scheduled):
+        # Latency counts from when the request was due, including time queued behind --concurrency
+        start = scheduled
+        try:
+            status, nbytes = send(record)
+        except Exception as e:
+            print(f"Request failed: {e}")
+            status, nbytes = None, 0
+        latency = time.perf_counter() - start
+        with results_lock:
+            results.append((latency, status, nbytes))
+
+    first_ts = records[0].get("ts", 0) if records else 0
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            if speedup > 0:
+                due = (record.get("ts", first_ts) - first_ts) / speedup
+                wait = due - (time.perf_counter() - wall_start)
+                if wait > 0:
+                    time.sleep(wait)
+                scheduled = wall_start + due
+            else:
+                scheduled = time.perf_counter()
+            executor.submit(run, record, scheduled)
+    wall_time = time.perf_counter() - wall_start
+
+    return results, wall_time
+
+
+def print_report(results, wall_time):
+    latencies = sorted(r[0] * 1000 for r in results)
+    errors = sum(1 for r in results if r[1] is None or r[1] >= 400)
+    total_bytes = sum(r[2] for r in results)
+
+    print("\nReplay summary")
+    print("==============")
+    print(f"Requests:    {len(results)} ({errors} errors)")
+    print(f"Wall time:   {wall_time:.2f} s")
+    if wall_time > 0:
+        print(f"Throughput:  {len(results) / wall_time:.2f} req/s, {total_bytes / wall_time / 1e6:.2f} MB/s")
+    if latencies:
+        print(f"Latency p50: {percentile(latencies, 50):.1f} ms")
+        print(f"Latency p95: {percentile(latencies, 95):.1f} ms")
+        print(f"Latency p99: {percentile(latencies, 99):.1f} ms")
+        print(f"Latency max: {latencies[-1]:.1f} ms")
+
+    if resource is None:
+        return
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1024
+    print(f"Peak RSS:    {peak_rss_mb:.0f} MB (this process; meaningful for in-process replays)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a herbie_server request log")
+    parser.add_argument("log", help="JSONL request log written via REQUEST_LOG_PATH")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests in flight")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="Divide original inter-request gaps by this factor (0 = as fast as possible)")
+    parser.add_argument("--url", help="Replay against a running server instead of in-process with stubbed Herbie")
+    parser.add_argument("--data-dir", help="Cache directory for in-process mode (default: fresh temp dir)")
+    parser.add_argument("--stub-resolution", type=float, default=1.0, help="Stub grid spacing in degrees")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="Seconds the stub sleeps per fetch")
+    args = parser.parse_args()
+
+    records = load_log(args.log)
+    if not records:
+        print(f"No replayable requests found in {args.log}")
+        return 1
+    print(f"Loaded {len(records)} requests from {args.log}")
+
+    if args.url:
+        send = make_http_sender(args.url)
+        results, wall_time = replay(records, send, args.concurrency, args.speedup)
+    else:
+        StubHerbie.resolution = args.stub_resolution
+        StubHerbie.delay = args.stub_delay
+        with tempfile.TemporaryDirectory(prefix="herbie_replay_") as tmp_dir:
+            send = make_in_process_sender(args.data_dir or tmp_dir)
+            results, wall_time = replay(records, send, args.concurrency, args.speedup)
+
+    print_report(results, wall_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
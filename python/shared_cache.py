@@ -0,0 +1,206 @@
+"""
+Cache shared by every herbie_server worker process on one host.
+
+Cached files live in the data directory and are tracked in a small SQLite
+index. A per-key file lock gives cross-process single-flight: when several
+workers miss the same key at once, one of them builds it while the others
+wait and then read the result. Decoded wind grids are stored as .npy files
+and opened with mmap, so workers share the page cache instead of holding
+their own copy of each grid.
+
+Lock files are removed when released. Nothing is evicted automatically;
+call prune(max_bytes) to delete the oldest entries once the indexed files
+exceed a size budget. The index keeps a running total of file sizes, so
+prune() is cheap while the cache is under budget.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process locking only
+    fcntl = None
+    import threading
+    _thread_locks = {}
+    _thread_locks_guard = threading.Lock()
+
+
+class SharedCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "cache_index.sqlite")
+        self.lock_dir = os.path.join(cache_dir, ".locks")
+        self._initialized = False
+
+    def _init(self):
+        if self._initialized:
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " path TEXT NOT NULL,"
+                " bytes INTEGER,"
+                " created_at REAL NOT NULL,"
+                " meta TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)")
+            # Running size of all indexed files, so prune() can skip the scan while under budget
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (total_bytes INTEGER NOT NULL)")
+            conn.execute(
+                "INSERT INTO stats (total_bytes) SELECT COALESCE(SUM(bytes), 0) FROM entries"
+                " WHERE NOT EXISTS (SELECT 1 FROM stats)"
+            )
+        self._initialized = True
+
+    @contextmanager
+    def _connect(self):
+        """Open an index connection for one transaction and close it afterwards"""
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, key, path, max_age=None):
+        """Return the index entry for key if its file exists and is younger than max_age seconds"""
+        self._init()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT path, bytes, created_at, meta FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            # Files written before the index existed (or by another tool) are adopted
+            if not os.path.exists(path):
+                return None
+            row = (path, os.path.getsize(path), os.path.getmtime(path), None)
+            self.record(key, path, row[1], created_at=row[2])
+
+        entry = {
+            "path": row[0],
+            "bytes": row[1],
+            "created_at": row[2],
+            "meta": json.loads(row[3]) if row[3] else None,
+        }
+        if not os.path.exists(entry["path"]):
+            return None
+        if max_age is not None and time.time() - entry["created_at"] > max_age:
+            return None
+        return entry
+
+    def record(self, key, path, nbytes, meta=None, created_at=None):
+        """Add or replace the index entry for key"""
+        self._init()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE stats SET total_bytes = total_bytes + ? - COALESCE((SELECT bytes FROM entries WHERE key = ?), 0)",
+                (nbytes or 0, key),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, path, bytes, created_at, meta) VALUES (?, ?, ?, ?, ?)",
+                (key, path, nbytes, created_at or time.time(), json.dumps(meta) if meta is not None else None),
+            )
+
+    @contextmanager
+    def single_flight(self, key):
+        """Hold an exclusive cross-process lock for key while the caller builds it"""
+        self._init()
+        if fcntl is None:
+            with _thread_locks_guard:
+                lock = _thread_locks.setdefault(key, threading.Lock())
+            with lock:
+                yield
+            return
+
+        lock_path = os.path.join(self.lock_dir, f"{key}.lock")
+        while True:
+            lock_file = open(lock_path, "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # The previous holder may have unlinked the file while we waited; retry on a fresh one
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+        try:
+            yield
+        finally:
+            # Unlink while still holding the lock so waiters notice and retry
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def prune(self, max_bytes):
+        """Delete the oldest entries until the indexed files total at most max_bytes, returning how many"""
+        self._init()
+        with self._connect() as conn:
+            total = conn.execute("SELECT total_bytes FROM stats").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            removed = []
+            for key, path, nbytes in conn.execute("SELECT key, path, bytes FROM entries ORDER BY created_at"):
+                if total <= max_bytes:
+                    break
+                removed.append((key, path))
+                total -= nbytes or 0
+
+        for _, path in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._connect() as conn:
+            for key, _ in removed:
+                # Only count rows still present, in case another worker pruned them first
+                conn.execute(
+                    "UPDATE stats SET total_bytes = total_bytes - COALESCE((SELECT bytes FROM entries WHERE key = ?), 0)",
+                    (key,),
+                )
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return len(removed)
+
+    def write_atomic(self, path, write, mode="wb"):
+        """Write a file via write(f) into a temp file and rename it into place"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    def save_grid(self, key, path, grid, meta):
+        """Store a decoded grid as .npy and return it re-opened as a read-only memory map"""
+        nbytes = self.write_atomic(path, lambda f: np.save(f, grid))
+        self.record(key, path, nbytes, meta)
+        return np.load(path, mmap_mode="r"), meta
+
+    def load_grid(self, key, path, max_age=None):
+        """Return (memory-mapped grid, meta) for key, or None when absent or expired"""
+        entry = self.lookup(key, path, max_age)
+        if entry is None or entry["meta"] is None:
+            return None
+        try:
+            return np.load(entry["path"], mmap_mode="r"), entry["meta"]
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not open cached grid {entry['path']}: {e}")
+            return None